@@ -1,11 +1,16 @@
 import os
 import argparse
+import functools
+import math
 import diyepw
 import pandas as pd
-from glob import iglob
+from concurrent.futures import ProcessPoolExecutor
 
 output_dir_path = 'outputs/analyze_noaa_data_output'
 
+# The formats that the output files can be written in
+output_formats = ['csv', 'feather', 'parquet']
+
 parser = argparse.ArgumentParser(
     description='Perform an analysis of a set of NOAA ISA Lite files, determining which are '
                 'suitable for conversion to AMY EPW files.'
@@ -33,59 +38,114 @@ parser.add_argument('--max-consecutive-missing-rows',
                     default=48,
                     type=int,
                     help='ISD files with more than this number of consecutive missing rows will be excluded from the output')
-args = parser.parse_args()
+parser.add_argument('--output-format',
+                    default='csv',
+                    choices=output_formats,
+                    help='The format to write the output files in. Feather and Parquet are faster to write and read for '
+                         'large numbers of files, and require pyarrow to be installed. create_amy_epw_files.py can read '
+                         'any of these formats.')
 
-# Make a directory to store results if it doesn't already exist.
-if not os.path.exists(output_dir_path):
-    os.makedirs(output_dir_path)
 
-if not os.path.exists(args.inputs) or not os.path.isdir(args.inputs):
-    raise Exception(f'The path {args.inputs} does not appear to be a valid directory path')
+def write_results(results: list, path: str, output_format: str):
+    """
+    Write a list of analysis results to a file in the requested format, removing any copies of the file in the
+    other formats
+    :param results: A list of analysis results, as returned by diyepw.analyze_noaa_isd_lite_files()
+    :param path: The path of the file to write
+    :param output_format: One of "csv", "feather" or "parquet"
+    """
+    # Remove any copy of this file previously written in one of the other formats, so that create_amy_epw_files.py
+    # never has to guess which of several lists is the current one.
+    path_without_extension = os.path.splitext(path)[0]
+    for other_format in output_formats:
+        other_path = f'{path_without_extension}.{other_format}'
+        if other_format != output_format and os.path.exists(other_path):
+            os.remove(other_path)
 
-# Recursively search for all files under the passed path, excluding directories
-input_files = [file for file in iglob(args.inputs + '/**/*', recursive=True) if not os.path.isdir(file)]
+    results_df = pd.DataFrame(results)
+    if output_format == 'feather':
+        results_df.to_feather(path)
+    elif output_format == 'parquet':
+        results_df.to_parquet(path, index=False)
+    else:
+        results_df.to_csv(path, index=False)
 
-analysis_results = diyepw.analyze_noaa_isd_lite_files(
-    input_files,
-    max_missing_rows=args.max_missing_rows,
-    max_consecutive_missing_rows=args.max_consecutive_missing_rows
-)
 
-# Write the dataframes to CSVs for the output files.
-num_files_with_too_many_rows_missing = len(analysis_results['too_many_total_rows_missing'])
-if num_files_with_too_many_rows_missing > 0:
-    path = os.path.join(output_dir_path, 'missing_total_entries_high.csv')
-    path = os.path.abspath(path) # Change to absolute path for readability
-    print(
-        num_files_with_too_many_rows_missing,
-        "records excluded because they were missing more than", args.max_missing_rows,
-        "rows. Information about these files will be written to", path
-    )
-    pd.DataFrame(analysis_results['too_many_total_rows_missing']).to_csv(path, index=False)
-
-num_files_with_too_many_consec_rows_missing = len(analysis_results['too_many_consecutive_rows_missing'])
-if num_files_with_too_many_consec_rows_missing > 0:
-    path = os.path.join(output_dir_path, 'missing_consec_entries_high.csv')
-    path = os.path.abspath(path) # Change to absolute path for readability
-    print(
-        num_files_with_too_many_consec_rows_missing,
-        "records excluded because they were missing more than", args.max_consecutive_missing_rows,
-        "consecutive rows. Information about these files will be written to", path
-    )
-    pd.DataFrame(analysis_results['too_many_consecutive_rows_missing']).to_csv(path, index=False)
-
-num_good_files = len(analysis_results['good'])
-if num_good_files > 0:
-    path = os.path.join(output_dir_path, 'files_to_convert.csv')
-    path = os.path.abspath(path) # Change to absolute path for readability
-    print(
+# The analysis is run in worker processes, which on some platforms re-import this script, so everything that does
+# work must only run when the script is executed directly.
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    # Make a directory to store results if it doesn't already exist.
+    if not os.path.exists(output_dir_path):
+        os.makedirs(output_dir_path)
+
+    if not os.path.exists(args.inputs) or not os.path.isdir(args.inputs):
+        raise Exception(f'The path {args.inputs} does not appear to be a valid directory path')
+
+    # Recursively search for all files under the passed path, excluding directories. os.walk() already knows which
+    # entries are files from the directory listing, so this avoids a separate stat() call per file. As when this
+    # search was done with a "**/*" glob, symlinked directories are followed and hidden files and directories are
+    # skipped.
+    input_files = []
+    for dir_path, dir_names, file_names in os.walk(args.inputs, followlinks=True):
+        dir_names[:] = [dir_name for dir_name in dir_names if not dir_name.startswith('.')]
+        input_files.extend(
+            os.path.join(dir_path, file_name) for file_name in file_names if not file_name.startswith('.')
+        )
+
+    # Each file is analyzed independently, so we split the files into one contiguous chunk per CPU and analyze the
+    # chunks in parallel, then merge the per-chunk results back together in their original order.
+    analysis_results = {'too_many_total_rows_missing': [], 'too_many_consecutive_rows_missing': [], 'good': []}
+    if input_files:
+        num_chunks = min(len(input_files), os.cpu_count() or 1)
+        chunk_size = math.ceil(len(input_files) / num_chunks)
+        chunks = [input_files[start:start + chunk_size] for start in range(0, len(input_files), chunk_size)]
+        analyze_chunk = functools.partial(
+            diyepw.analyze_noaa_isd_lite_files,
+            max_missing_rows=args.max_missing_rows,
+            max_consecutive_missing_rows=args.max_consecutive_missing_rows
+        )
+        with ProcessPoolExecutor(max_workers=num_chunks) as executor:
+            for chunk_results in executor.map(analyze_chunk, chunks):
+                for result_type, files in analysis_results.items():
+                    files.extend(chunk_results[result_type])
+
+    # Write the results to the output files.
+    num_files_with_too_many_rows_missing = len(analysis_results['too_many_total_rows_missing'])
+    if num_files_with_too_many_rows_missing > 0:
+        path = os.path.join(output_dir_path, f'missing_total_entries_high.{args.output_format}')
+        path = os.path.abspath(path) # Change to absolute path for readability
+        print(
+            num_files_with_too_many_rows_missing,
+            "records excluded because they were missing more than", args.max_missing_rows,
+            "rows. Information about these files will be written to", path
+        )
+        write_results(analysis_results['too_many_total_rows_missing'], path, args.output_format)
+
+    num_files_with_too_many_consec_rows_missing = len(analysis_results['too_many_consecutive_rows_missing'])
+    if num_files_with_too_many_consec_rows_missing > 0:
+        path = os.path.join(output_dir_path, f'missing_consec_entries_high.{args.output_format}')
+        path = os.path.abspath(path) # Change to absolute path for readability
+        print(
+            num_files_with_too_many_consec_rows_missing,
+            "records excluded because they were missing more than", args.max_consecutive_missing_rows,
+            "consecutive rows. Information about these files will be written to", path
+        )
+        write_results(analysis_results['too_many_consecutive_rows_missing'], path, args.output_format)
+
+    num_good_files = len(analysis_results['good'])
+    if num_good_files > 0:
+        path = os.path.join(output_dir_path, f'files_to_convert.{args.output_format}')
+        path = os.path.abspath(path) # Change to absolute path for readability
+        print(
+            num_good_files,
+            "records are complete enough to be processed. Information about these files will be written to", path
+        )
+        write_results(analysis_results['good'], path, args.output_format)
+
+    print('Done! {count} files processed.'.format(count=sum([
         num_good_files,
-        "records are complete enough to be processed. Information about these files will be written to", path
-    )
-    pd.DataFrame(analysis_results['good']).to_csv(path, index=False)
-
-print('Done! {count} files processed.'.format(count=sum([
-    num_good_files,
-    num_files_with_too_many_consec_rows_missing,
-    num_files_with_too_many_rows_missing
-])))
\ No newline at end of file
+        num_files_with_too_many_consec_rows_missing,
+        num_files_with_too_many_rows_missing
+    ])))
\ No newline at end of file
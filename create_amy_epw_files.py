@@ -1,32 +1,24 @@
 import os
 import pandas as pd
 import argparse
+import functools
 import diyepw
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
 # Set path to outputs produced by this script.
 create_out_path = os.path.abspath(os.path.join('outputs', 'create_amy_epw_files_output'))
-if not os.path.exists(create_out_path):
-    os.mkdir(create_out_path)
 
 # Set path to where new EPW files should be saved.
 amy_epw_file_out_path = os.path.join(create_out_path, 'epw')
-if not os.path.exists(amy_epw_file_out_path):
-    os.mkdir(amy_epw_file_out_path)
 
-# Set path to the list of WMO stations for which new AMY EPW files should be created.
-path_to_station_list = os.path.abspath(os.path.join('outputs', 'analyze_noaa_data_output', 'files_to_convert.csv'))
-if not os.path.exists(path_to_station_list):
-    print(f"{path_to_station_list} does not exist. Please run analyze_noaa_isd_lite_files.py before running this script.")
-    exit(1)
+# Set path to the directory containing the list of WMO stations for which new AMY EPW files should be created.
+station_list_dir = os.path.abspath(os.path.join('outputs', 'analyze_noaa_data_output'))
 
 # Set path to the files where errors should be written
 epw_file_violations_path = os.path.join(create_out_path, 'epw_validation_errors.csv')
 errors_path = os.path.join(create_out_path, 'errors.csv')
 
-# Ensure that the errors file is truncated
-with open(errors_path, 'w'):
-    pass
-
 parser = argparse.ArgumentParser(
     description=f"""
         Generate epw files based on the files generated by analyze_noaa_data.py, which must be called prior to this 
@@ -54,51 +46,132 @@ parser.add_argument('--max-records-to-impute',
                             the missing value. If there are more consecutive missing records than this limit, then the 
                             file will not be processed, and will be added to the error file at {errors_path}."""
 )
-args = parser.parse_args()
-
-# Read in list of AMY files that should be used to create EPW files.
-amy_file_list = pd.read_csv(path_to_station_list)
-amy_file_list = amy_file_list[amy_file_list.columns[0]]
-
-# Initialize the df to hold paths of AMY files that could not be converted to an EPW.
-errors = pd.DataFrame(columns=['file', 'error'])
-
-num_files = len(amy_file_list)
-for idx, amy_file_path in enumerate(amy_file_list, start = 1):
-    # The NOAA ISD Lite AMY files are stored in directories named the same as the year they describe, so we
-    # use that directory name to get the year
-    amy_file_dir = os.path.dirname(amy_file_path)
-    year = int(amy_file_dir.split(os.path.sep)[-1])
-    next_year = year + 1
-
-    # To get the WMO, we have to parse it out of the filename: it's the portion prior to the first hyphen
-    wmo_index = int(os.path.basename(amy_file_path).split('-')[0])
-
-    # Our NOAA ISD Lite input files are organized under inputs/NOAA_ISD_Lite_Raw/ in directories named after their
-    # years, and the files are named identically (<WMO>_<###>_<Year>.gz), so we can get the path to the subsequent
-    # year's file by switching directories and swapping the year in the file name.
-    s = os.path.sep
-    amy_subsequent_year_file_path = amy_file_path.replace(s + str(year) + s, s + str(next_year) + s)\
-                                                 .replace(f'-{year}.gz', f'-{next_year}.gz')
-    try:
-        amy_epw_file_path = diyepw.create_amy_epw_file(
-            wmo_index=wmo_index,
-            year=year,
-            max_records_to_impute=args.max_records_to_impute,
-            max_records_to_interpolate=args.max_records_to_interpolate,
+
+def create_amy_epw_files_for_wmo(amy_file_paths: list, amy_epw_dir: str, max_records_to_impute: int,
+                                 max_records_to_interpolate: int):
+    """
+    Generate an AMY EPW file for each of a set of ISD Lite files belonging to a single WMO index. All of a WMO's
+    files are handled by the same worker, so that the WMO's TMY EPW file is never downloaded by two workers at once.
+    :param amy_file_paths: The paths of the ISD Lite files to convert, all of which must be for the same WMO index
+    :param amy_epw_dir: The directory to write the generated AMY EPW files to
+    :param max_records_to_impute: See the --max-records-to-impute argument
+    :param max_records_to_interpolate: See the --max-records-to-interpolate argument
+    :return: A list with one (amy_file_path, amy_epw_file_path, error) tuple per file, in the same order as
+        amy_file_paths. For each file, either
+        amy_epw_file_path or error will be None, depending on whether the file was converted successfully.
+    """
+    results = []
+    for amy_file_path in amy_file_paths:
+        # The NOAA ISD Lite AMY files are stored in directories named the same as the year they describe, so we
+        # use that directory name to get the year
+        amy_file_dir = os.path.dirname(amy_file_path)
+        year = int(amy_file_dir.split(os.path.sep)[-1])
+        next_year = year + 1
+
+        # To get the WMO, we have to parse it out of the filename: it's the portion prior to the first hyphen
+        wmo_index = int(os.path.basename(amy_file_path).split('-')[0])
+
+        # Our NOAA ISD Lite input files are organized under inputs/NOAA_ISD_Lite_Raw/ in directories named after their
+        # years, and the files are named identically (<WMO>_<###>_<Year>.gz), so we can get the path to the subsequent
+        # year's file by switching directories and swapping the year in the file name.
+        s = os.path.sep
+        amy_subsequent_year_file_path = amy_file_path.replace(s + str(year) + s, s + str(next_year) + s)\
+                                                     .replace(f'-{year}.gz', f'-{next_year}.gz')
+        try:
+            amy_epw_file_path = diyepw.create_amy_epw_file(
+                wmo_index=wmo_index,
+                year=year,
+                max_records_to_impute=max_records_to_impute,
+                max_records_to_interpolate=max_records_to_interpolate,
+                amy_epw_dir=amy_epw_dir,
+                amy_files=(amy_file_path, amy_subsequent_year_file_path)
+            )
+            results.append((amy_file_path, amy_epw_file_path, None))
+        except Exception as e:
+            results.append((amy_file_path, None, str(e)))
+
+    return results
+
+
+# The EPW files are generated in worker processes, which on some platforms re-import this script, so everything that
+# does work must only run when the script is executed directly.
+if __name__ == '__main__':
+    if not os.path.exists(create_out_path):
+        os.mkdir(create_out_path)
+    if not os.path.exists(amy_epw_file_out_path):
+        os.mkdir(amy_epw_file_out_path)
+
+    # analyze_noaa_data.py can write the list of files to convert as CSV, Feather or Parquet, and removes the list in
+    # the other formats when it does, so there should be exactly one of these files.
+    candidate_station_list_paths = [
+        os.path.join(station_list_dir, f'files_to_convert.{ext}') for ext in ('csv', 'feather', 'parquet')
+    ]
+    station_list_paths = [path for path in candidate_station_list_paths if os.path.exists(path)]
+    if not station_list_paths:
+        print(f"None of {', '.join(candidate_station_list_paths)} exist. Please run analyze_noaa_data.py before running "
+              f"this script.")
+        exit(1)
+    if len(station_list_paths) > 1:
+        print(f"More than one list of files to convert was found ({', '.join(station_list_paths)}). Please remove all "
+              f"but the one that should be used.")
+        exit(1)
+    path_to_station_list = station_list_paths[0]
+
+    # Ensure that the errors file is truncated
+    with open(errors_path, 'w'):
+        pass
+
+    args = parser.parse_args()
+
+    # Read in list of AMY files that should be used to create EPW files.
+    if path_to_station_list.endswith('.feather'):
+        amy_file_list = pd.read_feather(path_to_station_list)
+    elif path_to_station_list.endswith('.parquet'):
+        amy_file_list = pd.read_parquet(path_to_station_list)
+    else:
+        amy_file_list = pd.read_csv(path_to_station_list)
+    amy_file_list = amy_file_list[amy_file_list.columns[0]]
+
+    # Each WMO's files are independent of every other WMO's, so we group the files by WMO index and convert the
+    # groups in parallel. The WMO index is the portion of the filename prior to the first hyphen. We also keep each
+    # file's position in the list, so that errors can be reported in the same order as the files were listed.
+    amy_files_by_wmo_index = defaultdict(list)
+    positions_by_wmo_index = defaultdict(list)
+    for position, amy_file_path in enumerate(amy_file_list):
+        wmo_index = os.path.basename(amy_file_path).split('-')[0]
+        amy_files_by_wmo_index[wmo_index].append(amy_file_path)
+        positions_by_wmo_index[wmo_index].append(position)
+
+    # Initialize the dict to hold paths of AMY files that could not be converted to an EPW, keyed by their position
+    # in the list of files. The rows are turned into a DataFrame once at the end, rather than appending to a
+    # DataFrame (which copies it) on every error.
+    errors_by_position = {}
+
+    num_files = len(amy_file_list)
+    idx = 0
+    if amy_files_by_wmo_index:
+        convert_wmo_files = functools.partial(
+            create_amy_epw_files_for_wmo,
             amy_epw_dir=amy_epw_file_out_path,
-            amy_files=(amy_file_path, amy_subsequent_year_file_path)
+            max_records_to_impute=args.max_records_to_impute,
+            max_records_to_interpolate=args.max_records_to_interpolate
         )
+        with ProcessPoolExecutor(max_workers=min(len(amy_files_by_wmo_index), os.cpu_count() or 1)) as executor:
+            wmo_results = executor.map(convert_wmo_files, amy_files_by_wmo_index.values())
+            for positions, results in zip(positions_by_wmo_index.values(), wmo_results):
+                for position, (amy_file_path, amy_epw_file_path, error) in zip(positions, results):
+                    idx += 1
+                    if error is None:
+                        print(f"Success! {os.path.basename(amy_file_path)} => {os.path.basename(amy_epw_file_path)} ({idx} / {num_files})")
+                    else:
+                        errors_by_position[position] = {"file": amy_file_path, "error": error}
+                        print(f"\n*** Error! {amy_file_path} could not be processed, see {errors_path} for details ({idx} / {num_files})\n")
 
-        print(f"Success! {os.path.basename(amy_file_path)} => {os.path.basename(amy_epw_file_path)} ({idx} / {num_files})")
-    except Exception as e:
-        errors = errors.append({"file": amy_file_path, "error": str(e)}, ignore_index=True)
-        print(f"\n*** Error! {amy_file_path} could not be processed, see {errors_path} for details ({idx} / {num_files})\n")
-
-print("\nDone!")
+    print("\nDone!")
 
-if not errors.empty:
-     print(len(errors), f"files encountered errors - see {errors_path} for more information")
-     errors.to_csv(errors_path, mode='w', index=False)
+    errors = [errors_by_position[position] for position in sorted(errors_by_position)]
+    if errors:
+        print(len(errors), f"files encountered errors - see {errors_path} for more information")
+        pd.DataFrame(errors, columns=['file', 'error']).to_csv(errors_path, mode='w', index=False)
 
-print(num_files - len(errors), f'files successfully processed. EPWs were written to {amy_epw_file_out_path}.')
+    print(num_files - len(errors), f'files successfully processed. EPWs were written to {amy_epw_file_out_path}.')
@@ -81,20 +81,25 @@ def get_years_list(years_str:str) -> List[int]:
     Transform the years argument string, which can be formatted like "2000, 2001, 2005-2010" (individual years or
     ranges, comma separated, not necessarily sorted, with optional spaces), into a sorted list of integers
     """
-    # Transform the years argument from a string like  to a sorted list
-    years_list = []
-    years_str = years_str.replace(" ", "")  # Ignore any spaces
+    # Collect the years into a set, so that overlapping entries like "2000-2005,2003" are only counted once
+    years_set = set()
     for year_arg_part in years_str.split(","):  # We'll process each comma-separated entry in the list of years
+        # int() ignores surrounding spaces on its own, so we only need to skip entries that are entirely blank
+        if not year_arg_part.strip():
+            continue
         if "-" in year_arg_part:  # If there is a hyphen, then it's a range like "2000-2010"
             start_year, end_year = year_arg_part.split("-")
-            years_list += range(int(start_year), int(end_year) + 1)
+            years_set.update(range(int(start_year), int(end_year) + 1))
         else:  # If there is no hyphen, it's just a single year
-            years_list.append(int(year_arg_part))
-    years_list.sort()
+            years_set.add(int(year_arg_part))
+    years_list = sorted(years_set)
+    if not years_list:
+        raise Exception("At least one year must be provided")
 
-    # Validate that the years are between 1900 and the present
-    this_year = datetime.datetime.now().year
-    if min(years_list) < 1900 or max(years_list) > this_year:
+    # Validate that the years are between 1900 and the present. The list is sorted, so its first and last
+    # entries are its minimum and maximum.
+    this_year = datetime.date.today().year
+    if years_list[0] < 1900 or years_list[-1] > this_year:
         raise Exception(f"Years must be in the range 1900-{this_year}")
 
     return years_list
@@ -106,10 +111,11 @@ def get_wmo_indices_list(wmo_indices_str) -> List[int]:
     :param wmo_indices_str:
     :return:
     """
-    wmo_indices_str = wmo_indices_str.replace(" ", "") # Ignore any spaces
-
-    # Split on "," and convert each value to an integer
-    wmo_indices_list = [int(wmo_index) for wmo_index in wmo_indices_str.split(",")]
+    # Split on "," and convert each value to an integer. int() ignores surrounding spaces on its own, so we only need
+    # to skip entries that are entirely blank. Collecting into a set drops any duplicates before sorting.
+    wmo_indices_list = sorted({int(wmo_index) for wmo_index in wmo_indices_str.split(",") if wmo_index.strip()})
+    if not wmo_indices_list:
+        raise Exception("At least one WMO index must be provided")
 
     return wmo_indices_list
 